@@ -1,14 +1,28 @@
+import os
+
+# Patch the standard library for cooperative I/O when running under gevent workers
+if os.environ.get('GEVENT') == '1':
+    from gevent import monkey
+    monkey.patch_all()
+
 from flask import Flask, request, jsonify
 import pandas as pd
-import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 import io
-import math
-import os
-import json
 import logging
-from datetime import datetime, date
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+import threading
+import hashlib
+import codecs
+from cachetools import TTLCache
+from datetime import datetime, date, time, timedelta, timezone
+from decimal import Decimal
+from urllib.parse import urlparse
 from flask_cors import CORS
+from flask_compress import Compress
 
 # Configure logging
 logging.basicConfig(
@@ -19,27 +33,196 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
-
-# Custom JSON encoder to handle problematic data types
-class CustomJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, (datetime, date)):
-            return obj.isoformat()
-        elif isinstance(obj, np.integer):
-            return int(obj)
-        elif isinstance(obj, np.floating):
-            return float(obj)
-        elif isinstance(obj, np.ndarray):
-            return obj.tolist()
-        elif pd.isna(obj):
-            return None
+# Enable CORS for all routes, exposing the pagination headers used by binary responses
+CORS(app, expose_headers=['X-Current-Page', 'X-Total-Pages', 'X-Total-Rows', 'X-Rows-Per-Page'])
+
+# Compress JSON responses; large pages shrink by an order of magnitude over the wire
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_LEVEL'] = 4
+app.config['COMPRESS_BR_LEVEL'] = 4
+Compress(app)
+
+# Shared HTTP session so file downloads reuse pooled keep-alive connections
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=50, pool_maxsize=50, max_retries=3)
+SESSION.mount('http://', _adapter)
+SESSION.mount('https://', _adapter)
+
+# Parsed files keyed by URL so pagination requests skip the parse
+# Entries are (validators, arrow table, total rows); validators holds the source's ETag/Last-Modified
+CACHE = TTLCache(maxsize=32, ttl=7200)
+CACHE_LOCK = threading.Lock()
+
+# Pull the ETag/Last-Modified validators out of a source response (empty if it sent neither)
+def _get_validators(headers):
+    return {name: headers[name] for name in ('ETag', 'Last-Modified') if headers.get(name)}
+
+# Build conditional request headers so an unchanged source answers 304 instead of resending the file
+def _conditional_headers(validators):
+    headers = {}
+    if 'ETag' in validators:
+        headers['If-None-Match'] = validators['ETag']
+    if 'Last-Modified' in validators:
+        headers['If-Modified-Since'] = validators['Last-Modified']
+    return headers
+
+# Tag a single page of a source file version for conditional requests
+def _response_etag(source_etag, *parts):
+    key = '|'.join(str(part) for part in (source_etag, *parts))
+    return hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+
+# Column values for orient=columns; null-free numeric columns stay numpy arrays so orjson encodes them in one pass
+def _column_values(column):
+    if column.null_count == 0 and (pa.types.is_integer(column.type) or pa.types.is_floating(column.type)
+                                   or pa.types.is_boolean(column.type)):
+        return column.to_numpy()
+    return column.to_pylist()
+
+# Columnar binary alternatives to JSON, selected with ?format=
+BINARY_MIMETYPES = {
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# Serialize a page table as an Arrow IPC stream or Parquet file
+def _write_binary(page_table, response_format):
+    sink = io.BytesIO()
+    if response_format == 'arrow':
+        with pa.ipc.new_stream(sink, page_table.schema) as writer:
+            writer.write_table(page_table)
+    else:
+        pq.write_table(page_table, sink)
+    return sink.getvalue()
+
+# Magic bytes at the start of Excel workbooks
+XLSX_MAGIC = b'PK\x03\x04'  # Zip container used by .xlsx
+XLS_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'  # OLE2 container used by legacy .xls
+CSV_CONTENT_TYPES = ('text/csv', 'application/csv', 'text/plain')
+CSV_FALLBACK_ENCODING = 'latin-1'
+
+# Work out the file type from its first bytes and Content-Type, using the URL suffix only as a fallback
+def _detect_file_type(head, content_type, file_url):
+    content_type = content_type.split(';')[0].strip().lower()
+    if head.startswith(XLSX_MAGIC):
+        return 'xlsx'
+    elif head.startswith(XLS_MAGIC):
+        return 'xls'
+    elif content_type == 'text/html':
+        return None  # An error or login page, whatever the URL says
+    elif content_type in CSV_CONTENT_TYPES:
+        return 'csv'
+    
+    file_extension = urlparse(file_url).path.split('.')[-1].lower()
+    if file_extension == 'csv' or _looks_like_text(head):
+        return 'csv'
+    return None
+
+# Check whether leading bytes are UTF-8 text (not HTML/XML) with no NUL or other control bytes
+def _looks_like_text(head):
+    if head.startswith(b'\xef\xbb\xbf'):
+        head = head[3:]
+    if not head or head.startswith(b'<'):
+        return False
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # The peek window may cut a multi-byte character in half; anything else is binary
+        if e.reason != 'unexpected end of data':
+            return False
+    return all(b >= 32 and b != 127 or b in b'\t\r\n' for b in head)
+
+# Charset named in a Content-Type header, or None if missing or not a codec Python knows
+def _get_charset(content_type):
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.partition('=')
+        if key.strip().lower() == 'charset':
+            try:
+                return codecs.lookup(value.strip().strip('"\'')).name
+            except LookupError:
+                return None
+    return None
+
+# Parse a CSV body with pyarrow, decoding with the server's charset or UTF-8
+def _read_csv(body, charset):
+    try:
+        df = pd.read_csv(io.BytesIO(body), engine='pyarrow', dtype_backend='pyarrow', encoding=charset or 'utf-8')
+        if charset is not None or not any(_is_binary_dtype(dtype) for dtype in df.dtypes):
+            return df
+    except UnicodeDecodeError:
+        if charset is not None:
+            raise
+    # Not UTF-8 and the server named no charset (typical of Excel CSV exports); Latin-1 decodes any byte
+    return pd.read_csv(io.BytesIO(body), engine='pyarrow', dtype_backend='pyarrow', encoding=CSV_FALLBACK_ENCODING)
+
+# pyarrow types text columns that aren't valid in the chosen encoding as binary
+def _is_binary_dtype(dtype):
+    return isinstance(dtype, pd.ArrowDtype) and (pa.types.is_binary(dtype.pyarrow_dtype)
+                                                 or pa.types.is_large_binary(dtype.pyarrow_dtype))
+
+# Decode a binary Arrow column to strings so raw bytes never reach the JSON encoder
+def _decode_binary(arr):
+    try:
+        return arr.cast(pa.string())
+    except pa.ArrowInvalid:
+        return pa.array([None if v is None else v.decode(CSV_FALLBACK_ENCODING) for v in arr.to_pylist()], pa.string())
+
+# Render one cell of a mixed-type column as text, formatting dates the way orjson does for typed columns
+def _cell_to_str(value):
+    if pd.isna(value):
+        return None
+    elif isinstance(value, datetime):
+        # Match OPT_NAIVE_UTC, which typed datetime columns are serialized with
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).isoformat()
+    elif isinstance(value, (date, time)):
+        return value.isoformat()
+    return str(value)
+
+# Convert a parsed DataFrame into an Arrow table for zero-copy page slicing
+def _to_arrow_table(df):
+    arrays = []
+    for i in range(len(df.columns)):
+        col = df.iloc[:, i]
         try:
-            return super().default(obj)
-        except TypeError:
-            return str(obj)  # Convert anything else to string
+            arrays.append(pa.array(col, from_pandas=True))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Mixed-type object columns (common in Excel sheets) have no single Arrow type, so store that column as strings
+            arrays.append(pa.array(col.map(_cell_to_str), from_pandas=True))
+            continue
+        if pa.types.is_binary(arrays[-1].type) or pa.types.is_large_binary(arrays[-1].type):
+            arrays[-1] = _decode_binary(arrays[-1])
+        # Nanosecond timestamps come back from to_pylist() as pd.Timestamp, which orjson doesn't encode;
+        # microseconds give plain datetimes so every date goes through orjson (and OPT_NAIVE_UTC) the same way
+        if pa.types.is_timestamp(arrays[-1].type) and arrays[-1].type.unit == 'ns':
+            arrays[-1] = arrays[-1].cast(pa.timestamp('us', tz=arrays[-1].type.tz), safe=False)
+    return pa.Table.from_arrays(arrays, names=[str(c) for c in df.columns])
+
+# Decode bytes that reach the encoder, keeping undecodable input readable
+def _decode_bytes(obj):
+    try:
+        return obj.decode('utf-8')
+    except UnicodeDecodeError:
+        return obj.decode(CSV_FALLBACK_ENCODING)
 
-app.json_encoder = CustomJSONEncoder
+# Exact-type handlers for the values Arrow's to_pylist() yields that orjson can't encode natively
+_FALLBACK_DISPATCH = {
+    Decimal: float,
+    timedelta: lambda obj: pd.Timedelta(obj).isoformat(),  # ISO 8601 duration, e.g. P0DT0H0M3S
+    bytes: _decode_bytes,
+}
+
+# Fallback for values orjson cannot serialize natively
+def _fallback(obj):
+    handler = _FALLBACK_DISPATCH.get(type(obj))
+    if handler is not None:
+        return handler(obj)
+    return str(obj)  # Convert anything else to string
+
+# orjson options resolved once at import; output is already compact UTF-8 with no ASCII escaping
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+
+# Serialize a response payload to JSON bytes
+def _dumps(obj):
+    return orjson.dumps(obj, default=_fallback, option=ORJSON_OPTIONS)
 
 # Add a health check endpoint
 @app.route('/health', methods=['GET'])
@@ -54,12 +237,12 @@ def get_data():
     page = request.args.get('page', '1')
     rows_per_page = request.args.get('rows_per_page', '100')
     
-    # Mask part of the URL for privacy in logs if needed
+    # Mask part of the URL for privacy in logs if needed (skipped when INFO logs are off)
     safe_url = file_url
-    if len(file_url) > 30:
+    if logger.isEnabledFor(logging.INFO) and len(file_url) > 30:
         safe_url = f"{file_url[:15]}...{file_url[-15:]}"
     
-    logger.info(f"Received request: URL={safe_url}, page={page}, rows_per_page={rows_per_page}")
+    logger.info("Received request: URL=%s, page=%s, rows_per_page=%s", safe_url, page, rows_per_page)
     
     # Get parameters from request
     file_url = request.args.get('url')
@@ -69,7 +252,7 @@ def get_data():
         page = int(request.args.get('page', 1))
     except ValueError:
         error_msg = "Page parameter must be a valid integer"
-        logger.error(f"Error: {error_msg}")
+        logger.error("Error: %s", error_msg)
         return jsonify({"error": error_msg}), 400
         
     try:
@@ -79,110 +262,187 @@ def get_data():
         # Enforce upper limit of 5000 rows per page
         MAX_ROWS_PER_PAGE = 5000
         if rows_per_page > MAX_ROWS_PER_PAGE:
-            logger.warning(f"Requested rows_per_page ({rows_per_page}) exceeds maximum allowed ({MAX_ROWS_PER_PAGE}). Using maximum value.")
+            logger.warning("Requested rows_per_page (%d) exceeds maximum allowed (%d). Using maximum value.", rows_per_page, MAX_ROWS_PER_PAGE)
             rows_per_page = MAX_ROWS_PER_PAGE
     except ValueError:
         error_msg = "Rows per page parameter must be a valid integer"
-        logger.error(f"Error: {error_msg}")
+        logger.error("Error: %s", error_msg)
+        return jsonify({"error": error_msg}), 400
+    
+    response_format = request.args.get('format', 'json').lower()
+    if response_format != 'json' and response_format not in BINARY_MIMETYPES:
+        error_msg = "Unsupported response format. Only json, arrow, and parquet are supported"
+        logger.error("Error: %s", error_msg)
+        return jsonify({"error": error_msg}), 400
+    
+    orient = request.args.get('orient', 'records').lower()
+    if orient not in ('records', 'columns'):
+        error_msg = "Unsupported orient. Only records and columns are supported"
+        logger.error("Error: %s", error_msg)
         return jsonify({"error": error_msg}), 400
     
     if not file_url:
         error_msg = "URL parameter is required"
-        logger.error(f"Error: {error_msg}")
+        logger.error("Error: %s", error_msg)
+        return jsonify({"error": error_msg}), 400
+    
+    # Reject impossible pagination values before spending a download and parse on them
+    if page < 1:
+        error_msg = "Page parameter must be 1 or greater"
+        logger.error("Error: %s", error_msg)
+        return jsonify({"error": error_msg}), 400
+    
+    if rows_per_page < 1:
+        error_msg = "Rows per page parameter must be 1 or greater"
+        logger.error("Error: %s", error_msg)
         return jsonify({"error": error_msg}), 400
     
     try:
-        # Download the file from the URL
-        logger.info(f"Downloading file from URL: {safe_url}")
-        response = requests.get(file_url)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        logger.info(f"File downloaded successfully, status_code={response.status_code}")
-        
-        # Determine file type from URL
-        file_extension = file_url.split('.')[-1].lower()
-        logger.info(f"Detected file extension: {file_extension}")
+        current_date = datetime.now().strftime('%Y-%m-%d')
         
-        # Read the file into a pandas DataFrame
-        if file_extension == 'csv':
-            df = pd.read_csv(io.StringIO(response.text))
-            logger.info(f"Parsed CSV file: {len(df)} rows, {len(df.columns)} columns")
-        elif file_extension in ['xlsx', 'xls']:
-            df = pd.read_excel(io.BytesIO(response.content))
-            logger.info(f"Parsed Excel file: {len(df)} rows, {len(df.columns)} columns")
-        else:
-            error_msg = "Unsupported file format. Only .xlsx, .xls, and .csv are supported"
-            logger.error(f"Error: {error_msg}")
-            return jsonify({"error": error_msg}), 400
+        # Revalidate any cached copy with a conditional GET; an upstream 304 means the cached table is current
+        with CACHE_LOCK:
+            cached = CACHE.get(file_url)
+        conditional_headers = _conditional_headers(cached[0]) if cached is not None else {}
         
-        # Handle NaN values and convert problematic data types
-        df = df.replace({np.nan: None})
-        logger.info("Replaced NaN values with None")
+        logger.info("Downloading file from URL: %s", safe_url)
+        with SESSION.get(file_url, headers=conditional_headers, timeout=30, stream=True) as response:
+            if cached is not None and response.status_code == 304:
+                validators, table, total_rows = cached
+                logger.info("Cache hit for URL: %s", safe_url)
+            else:
+                response.raise_for_status()  # Raise an exception for HTTP errors
+                response.raw.decode_content = True  # Let urllib3 undo any gzip/deflate transfer encoding
+                response.raw.auto_close = False  # Keep the stream readable after a peek drains a small body
+                logger.info("File download started, status_code=%d", response.status_code)
+                
+                # Key the cache on the validators of the body actually received
+                validators = _get_validators(response.headers)
+                
+                # Determine file type from the leading bytes and Content-Type, peeking without consuming the stream
+                stream = io.BufferedReader(response.raw)
+                file_type = _detect_file_type(
+                    stream.peek(8)[:8],
+                    response.headers.get('Content-Type', ''),
+                    file_url
+                )
+                logger.info("Detected file type: %s", file_type)
+                
+                # Read the file into a pandas DataFrame
+                if file_type == 'csv':
+                    # Read the body in this greenlet first: pyarrow reads file objects from its own C++ threads,
+                    # which deadlock on a gevent-patched socket
+                    df = _read_csv(stream.read(), _get_charset(response.headers.get('Content-Type', '')))
+                    logger.info("Parsed CSV file: %d rows, %d columns", len(df), len(df.columns))
+                elif file_type in ['xlsx', 'xls']:
+                    # Excel readers need a seekable buffer; calamine parses both .xlsx and .xls
+                    df = pd.read_excel(io.BytesIO(stream.read()), engine='calamine')
+                    logger.info("Parsed Excel file: %d rows, %d columns", len(df), len(df.columns))
+                else:
+                    error_msg = "Unsupported file format. Only .xlsx, .xls, and .csv are supported"
+                    logger.error("Error: %s", error_msg)
+                    return jsonify({"error": error_msg}), 400
+                
+                # Store as an Arrow table so every page is a zero-copy slice (NaN becomes null)
+                table = _to_arrow_table(df)
+                total_rows = table.num_rows
+                
+                # Without a validator the entry could never be revalidated, so don't let it evict useful ones
+                if validators:
+                    with CACHE_LOCK:
+                        CACHE[file_url] = (validators, table, total_rows)
         
         # Calculate pagination
-        total_rows = len(df)
-        total_pages = math.ceil(total_rows / rows_per_page)
-        logger.info(f"Pagination: total_rows={total_rows}, total_pages={total_pages}")
+        total_pages = -(-total_rows // rows_per_page)  # Integer ceiling division
+        logger.info("Pagination: total_rows=%d, total_pages=%d", total_rows, total_pages)
         
-        # Validate page number
-        if page < 1 or (total_rows > 0 and page > total_pages):
+        # Validate page number against the file's size
+        if total_rows > 0 and page > total_pages:
             error_msg = f"Invalid page number. Valid range: 1-{total_pages}"
-            logger.error(f"Error: {error_msg}")
+            logger.error("Error: %s", error_msg)
             return jsonify({"error": error_msg}), 400
         
+        # Let clients revalidate a page they already hold, once the page is known to exist;
+        # pushDate is part of the tag so it rolls over daily
+        response_etag = None
+        source_tag = validators.get('ETag') or validators.get('Last-Modified')
+        if source_tag is not None:
+            response_etag = _response_etag(source_tag, page, rows_per_page, current_date, response_format, orient)
+            # If-None-Match uses weak comparison, so W/ tags from re-encoding proxies and * count as matches.
+            # Flask-Compress appends the encoding (e.g. ":gzip") to the tag it sends, so compare without it
+            client_tags = request.if_none_match.as_set(include_weak=True)
+            matched_tag = next((tag for tag in client_tags if tag.split(':')[0] == response_etag), None)
+            if matched_tag is not None or request.if_none_match.star_tag:
+                logger.info("Client copy of page %d is current, returning 304", page)
+                not_modified = app.response_class(status=304)
+                # Flask-Compress skips 304s, so echo the client's tag (with its encoding suffix) to keep its validator intact
+                if matched_tag is not None:
+                    not_modified.set_etag(matched_tag, weak=request.if_none_match.is_weak(matched_tag))
+                else:
+                    not_modified.set_etag(response_etag)
+                not_modified.cache_control.max_age = 300
+                return not_modified
+        
         # Get the requested page of data
         start_idx = (page - 1) * rows_per_page
         end_idx = min(start_idx + rows_per_page, total_rows)
-        page_data = df.iloc[start_idx:end_idx]
-        logger.info(f"Retrieved page {page}: rows {start_idx}-{end_idx}")
+        page_table = table.slice(start_idx, rows_per_page)
+        logger.info("Retrieved page %d: rows %d-%d", page, start_idx, end_idx)
         
-        # Convert to list of dictionaries with safer approach
-        try:
-            # Use pandas json conversion with date handling, then back to Python objects
-            json_str = page_data.to_json(orient='records', date_format='iso')
-            data = json.loads(json_str)
-            logger.info("Successfully converted page data to JSON")
-        except Exception as e:
-            logger.warning(f"Primary JSON conversion failed: {str(e)}, using fallback method")
-            # Fallback to manual dictionary creation with explicit string conversion
-            data = []
-            for _, row in page_data.iterrows():
-                row_dict = {}
-                for col in page_data.columns:
-                    row_dict[str(col)] = str(row[col]) if row[col] is not None else None
-                data.append(row_dict)
-            logger.info("Successfully converted page data to JSON using fallback method")
-            
         # Add pushDate field to every row
-        current_date = datetime.now().strftime('%Y-%m-%d')
-        logger.info(f"Adding pushDate={current_date} to each row")
-        for row in data:
-            row['pushDate'] = current_date
+        logger.info("Adding pushDate=%s to each row", current_date)
+        push_dates = pa.array([current_date] * page_table.num_rows, pa.string())
+        if 'pushDate' in page_table.column_names:
+            # Overwrite a source pushDate column in place rather than adding a duplicate field
+            page_table = page_table.set_column(page_table.column_names.index('pushDate'), 'pushDate', push_dates)
+        else:
+            page_table = page_table.append_column('pushDate', push_dates)
         
-        # Prepare response
-        response_data = {
-            "data": data,
-            "pagination": {
-                "current_page": page,
-                "total_pages": total_pages,
-                "total_rows": total_rows,
-                "rows_per_page": rows_per_page
+        # Binary formats skip row materialization and JSON encoding, so pagination goes in headers
+        if response_format in BINARY_MIMETYPES:
+            logger.info("Finished processing request successfully. Returning %d rows for page %d as %s", page_table.num_rows, page, response_format)
+            api_response = app.response_class(
+                response=_write_binary(page_table, response_format),
+                status=200,
+                mimetype=BINARY_MIMETYPES[response_format]
+            )
+            api_response.headers['X-Current-Page'] = str(page)
+            api_response.headers['X-Total-Pages'] = str(total_pages)
+            api_response.headers['X-Total-Rows'] = str(total_rows)
+            api_response.headers['X-Rows-Per-Page'] = str(rows_per_page)
+        else:
+            if orient == 'columns':
+                # One array per column, skipping per-row dicts entirely
+                data = {name: _column_values(column) for name, column in zip(page_table.column_names, page_table.columns)}
+                logger.info("Successfully converted page data to columns")
+            else:
+                # Convert to list of dictionaries in Arrow's C++ layer
+                data = page_table.to_pylist()
+                logger.info("Successfully converted page data to records")
+            
+            # Prepare response
+            response_data = {
+                "data": data,
+                "pagination": {
+                    "current_page": page,
+                    "total_pages": total_pages,
+                    "total_rows": total_rows,
+                    "rows_per_page": rows_per_page
+                }
             }
-        }
-        
-        # Manually convert to JSON to handle any edge cases
-        try:
-            logger.info(f"Finished processing request successfully. Returning {len(data)} rows for page {page}")
-            return app.response_class(
-                response=json.dumps(response_data, cls=CustomJSONEncoder),
+            
+            # Serialize with orjson; any failure falls through to the generic error handler below
+            logger.info("Finished processing request successfully. Returning %d rows for page %d", page_table.num_rows, page)
+            api_response = app.response_class(
+                response=_dumps(response_data),
                 status=200,
                 mimetype='application/json'
             )
-        except Exception as json_error:
-            error_msg = f"JSON serialization error: {str(json_error)}"
-            logger.error(error_msg)
-            # Last resort fallback
-            return jsonify({"error": "Could not serialize response data", 
-                           "details": str(json_error)}), 500
+        
+        if response_etag is not None:
+            api_response.set_etag(response_etag)
+            api_response.cache_control.max_age = 300
+        return api_response
     
     except requests.exceptions.RequestException as e:
         error_msg = f"Error fetching file: {str(e)}"
@@ -191,7 +451,7 @@ def get_data():
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
-        logger.error(f"Unhandled exception: {str(e)}\n{error_details}")
+        logger.error("Unhandled exception: %s\n%s", e, error_details)
         return jsonify({"error": f"Error processing file: {str(e)}"}), 500
 
 if __name__ == '__main__':
@@ -3,14 +3,18 @@ import os
 # Bind to the port specified by Render's environment variable
 bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
 
-# Configure number of worker processes
-workers = 4
+# Configure number of worker processes (override with WEB_CONCURRENCY).
+# gevent workers each handle many connections, and each keeps its own file cache, so a small count is enough
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+# Use gevent workers so in-flight file downloads are multiplexed on green threads.
+# File parsing is CPU-bound and blocks every other connection on its worker (cache hits included)
+# until it finishes; a parse longer than `timeout` also starves the heartbeat and the worker is killed.
+worker_class = 'gevent'
+worker_connections = 1000
 
 # Set timeout (in seconds)
 timeout = 120
 
-# Enable thread-based concurrency
-threads = 2
-
 # Reload workers when code changes (disable in production)
 reload = False 
\ No newline at end of file